@@ -14,7 +14,8 @@ The ``sbspk.SBSPK`` class automates the above:
  ('/tmp/3728897_2015_TB.bsp', '3728897'),
  ('/tmp/3054374_2000_SG344.bsp', '3054374')]
  
-Currently only single-object binary kernels are supproted.
+Each target gets its own single-object binary kernel, unless 
+``SBSPK.batch`` is set - then all targets are put into one file.
 ``sbspk`` provides also a simple command line utility 
 under the same name.
 
@@ -7,10 +7,42 @@ http://ssd.jpl.nasa.gov/?horizons_doc#spk
 import os
 import re
 import sys
-import pexpect
+import json
+import time
+import socket
 import logging
 import argparse
-from urllib.request import urlretrieve
+import threading
+import tempfile
+import functools
+import contextlib
+from ftplib import FTP, error_perm, all_errors as ftplib_errors
+from urllib.error import URLError
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Kernel download read size, much larger than the urllib default of 8 KiB
+_CHUNK_SIZE = 256*1024
+# Kernel file write buffer, amortizes write() calls over many chunks
+_WRITE_BUFFER_SIZE = 8*1024*1024
+
+# Horizons removes generated kernels from its ftp server after a while,
+# a cached kernel URL is not trusted when older than this (seconds)
+_URL_REUSE_WINDOW = 3600
+
+# Temporary download files are created private, kernels get the usual mode
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# Socket receive buffer (SO_RCVBUF) requested for the Horizons telnet socket
+_RCVBUF_SIZE = 1 << 20
+
+# Object ID printed by Horizons before the e-mail prompt, matched on raw bytes
+_OBJID_RE = re.compile(rb'object ID:\s*(\d+)')
+# Kernel URL within the matched ftp line
+_FTPURL_RE = re.compile(rb'ftp\S+')
 
 
 class SBSPKError(Exception):
@@ -26,6 +58,212 @@ class SBSPKError(Exception):
     pass
 
 
+class _TelnetSession(object):
+    ''' Minimal pexpect-like client for the Horizons telnet port.
+    
+    Talks over a plain TCP socket instead of driving a ``telnet`` binary
+    through a pty. Every telnet option offered by the server is refused,
+    which leaves a bare line-oriented conversation. As with pexpect,
+    ``before`` and ``after`` hold the bytes preceding and matching the
+    last ``expect`` pattern.
+    '''
+    
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        # Short prompt/answer exchanges, don't let Nagle hold them back
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, _RCVBUF_SIZE)
+        self.buffer = b''
+        self.before = b''
+        self.after = b''
+        # incomplete telnet command left over from the previous recv
+        self._pending = b''
+    
+    def sendline(self, s=''):
+        self.sock.sendall(s.encode('utf-8') + b'\r\n')
+    
+    def expect(self, patterns, timeout):
+        ''' Reads until one of ``patterns`` (regexes) shows up, returns
+        its index. Raises ``socket.timeout`` after ``timeout`` seconds. '''
+        if isinstance(patterns, (str, bytes)):
+            patterns = [patterns]
+        regexes = [re.compile(p.encode('utf-8') if isinstance(p, str) else p,
+                              re.DOTALL) for p in patterns]
+        deadline = time.monotonic() + timeout
+        while True:
+            found = None
+            for i, r in enumerate(regexes):
+                m = r.search(self.buffer)
+                if m is not None and (found is None or m.start() < found[1].start()):
+                    found = (i, m)
+            if found is not None:
+                i, m = found
+                self.before = self.buffer[:m.start()]
+                self.after = m.group(0)
+                self.buffer = self.buffer[m.end():]
+                return i
+            self.__read(deadline)
+    
+    def expect_exact(self, patterns, timeout):
+        ''' Like ``expect``, but ``patterns`` are plain strings located
+        with a substring search instead of a regex engine. '''
+        if isinstance(patterns, (str, bytes)):
+            patterns = [patterns]
+        literals = [p.encode('utf-8') if isinstance(p, str) else p for p in patterns]
+        longest = max(len(l) for l in literals)
+        deadline = time.monotonic() + timeout
+        start = 0
+        while True:
+            found = None
+            for i, l in enumerate(literals):
+                pos = self.buffer.find(l, start)
+                if pos >= 0 and (found is None or pos < found[1]):
+                    found = (i, pos)
+            if found is not None:
+                i, pos = found
+                end = pos + len(literals[i])
+                self.before = self.buffer[:pos]
+                self.after = self.buffer[pos:end]
+                self.buffer = self.buffer[end:]
+                return i
+            # Everything before this offset was already searched
+            start = max(0, len(self.buffer) - longest + 1)
+            self.__read(deadline)
+    
+    def close(self):
+        self.sock.close()
+    
+    def __read(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout('Timed out waiting for Horizons')
+        self.sock.settimeout(remaining)
+        data = self.sock.recv(4096)
+        if not data:
+            raise SBSPKError('Connection closed by Horizons')
+        self.buffer += self.__strip_telnet_commands(self._pending + data)
+    
+    def __strip_telnet_commands(self, data):
+        IAC, DONT, DO, WONT, WILL, SB, SE = 255, 254, 253, 252, 251, 250, 240
+        self._pending = b''
+        out = bytearray()
+        i = 0
+        while i < len(data):
+            if data[i] != IAC:
+                out.append(data[i])
+                i += 1
+                continue
+            if i + 1 >= len(data):
+                self._pending = data[i:]
+                break
+            cmd = data[i+1]
+            if cmd == IAC:
+                out.append(IAC)
+                i += 2
+            elif cmd in (DO, DONT, WILL, WONT):
+                if i + 2 >= len(data):
+                    self._pending = data[i:]
+                    break
+                if cmd == DO:
+                    self.sock.sendall(bytes([IAC, WONT, data[i+2]]))
+                elif cmd == WILL:
+                    self.sock.sendall(bytes([IAC, DONT, data[i+2]]))
+                i += 3
+            elif cmd == SB:
+                end = data.find(bytes([IAC, SE]), i)
+                if end < 0:
+                    self._pending = data[i:]
+                    break
+                i = end + 2
+            else:
+                i += 2
+        return bytes(out)
+
+
+class _FTPPool(object):
+    ''' Keeps logged-in FTP connections for reuse between kernel downloads.
+    
+    A connection is checked out for a single transfer, so parallel 
+    downloads from one host get separate connections, while sequential
+    ones share an already open control connection.
+    '''
+    
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+    
+    @contextlib.contextmanager
+    def connection(self, host, timeout):
+        ftp = self.__checkout(host, timeout)
+        try:
+            yield ftp
+        except BaseException:
+            # connection state is unknown, do not hand it out again
+            ftp.close()
+            raise
+        with self._lock:
+            self._idle.setdefault(host, []).append(ftp)
+    
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for ftps in idle.values():
+            for ftp in ftps:
+                try:
+                    ftp.quit()
+                except ftplib_errors:
+                    ftp.close()
+    
+    def __checkout(self, host, timeout):
+        while True:
+            with self._lock:
+                idle = self._idle.get(host)
+                ftp = idle.pop() if idle else None
+            if ftp is None:
+                break
+            try:
+                ftp.voidcmd('NOOP')
+                return ftp
+            except ftplib_errors:
+                # server dropped the idle connection, try the next one
+                ftp.close()
+        ftp = FTP(host, timeout=timeout)
+        try:
+            ftp.login()
+            ftp.voidcmd('TYPE I')
+        except BaseException:
+            ftp.close()
+            raise
+        return ftp
+
+
+@functools.lru_cache(maxsize=None)
+def _fileformat_template(fileformat):
+    ''' Turns ``fileformat`` into a ``str.format_map`` template.
+    
+    Only formats using ``{OBJID}``/``{TARGET}`` alone are taken as 
+    ``str.format`` strings. Formats with old-style ``<OBJID>``/``<TARGET>``
+    (possibly mixed with new ones) or with no placeholders at all keep 
+    the old plain replace meaning, other braces are literal characters. 
+    '''
+    old = "<OBJID>" in fileformat or "<TARGET>" in fileformat
+    new = "{OBJID}" in fileformat or "{TARGET}" in fileformat
+    if new and not old:
+        return fileformat
+    fileformat = fileformat.replace("{", "{{").replace("}", "}}")
+    for field in ("OBJID", "TARGET"):
+        fileformat = fileformat.replace("{{%s}}" % field, "{%s}" % field)
+        fileformat = fileformat.replace("<%s>" % field, "{%s}" % field)
+    return fileformat
+
+
+def _log_step(logger, th):
+    ''' Logs the last telnet exchange, only if DEBUG level is enabled. '''
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%r", th.before)
+        logger.debug("MATCH: %r", th.after)
+
+
 def __talk_function_demo(target, email, startdate, stopdate, timeout):
     ''' Short demo of a talk function protocol'''
     FTPURL = 'ftp://none.none'
@@ -51,7 +289,7 @@ def talk(target, email, startdate, stopdate, timeout):
         timeout (int): Max time to wait for expected JPL Horizons output, seconds.
     
     Raises:
-        pexpect.TIMEOUT: ``timeout`` was reached. Aside of network connectivity
+        socket.timeout: ``timeout`` was reached. Aside of network connectivity
                          problems may indicate Horizons interface change.
         sbspk.SBSPKError: Raised if either ``target`` was not found or object ID
                           could not be extracted from the telnet output.
@@ -64,99 +302,200 @@ def talk(target, email, startdate, stopdate, timeout):
     to capture most of its communication.
     '''
     logger = logging.getLogger("SBSPK_TalkLogger")
-    # Spawn telnet-horizons process which we will control with pexpect
-    th = pexpect.spawn('telnet horizons.jpl.nasa.gov 6775')
+    # Connect straight to the Horizons telnet port, no telnet client needed
+    th = _TelnetSession('horizons.jpl.nasa.gov', 6775, timeout)
     ex = th.expect
+    ee = th.expect_exact
     sl = th.sendline
     dt = timeout
     
-    # Wait for Horizons prompt
-    ex('Horizons>', timeout=dt)
-    logger.debug(str(th.before))
-    logger.debug("MATCH: "+str(th.after))
-
-    sl('PAGE')
-    ex(['PAGING toggled OFF'], timeout=dt)
-    logger.debug(str(th.before))
-    logger.debug("MATCH: " + str(th.after))
-    
-    # Send target body name to Horizons
-    sl(target)
-    
-    # Horizons will ask if you want to proceed with search
-    ex(['Continue'], timeout=dt)
-    logger.debug(str(th.before))
-    logger.debug("MATCH: " + str(th.after))
-    sl('yes')
-
-    rtn = ex(['\[S]PK', 'No matches found'], timeout=dt)
-    logger.debug(str(th.before))
-    logger.debug("MATCH: " + str(th.after))
-    if rtn == 1:
-        logger.error('No match found for ' + target)
-        raise SBSPKError('No match found for ' + target)
-    sl('s')
-
-    # Before email address prompt there's printed object ID
-    ex(['Enter your Internet e-mail address'], timeout=dt)
-    logger.debug(str(th.before))
-    logger.debug("MATCH: " + str(th.after))
-
-    # Parse pe.before to extract object ID
-    pattern = re.compile('.*object ID: *(?P<OBJID>[0-9]*)')
-    m = pattern.match(str(th.before))
-    if m is not None:
-        OBJID = m.group('OBJID')
-        logger.info("Object ID: " + OBJID)
-    else:
-        raise SBSPKError('Cannot parse object ID')
-
-    sl(email)
-    
-    ex(['Confirm e-mail address'], timeout=dt)
-    logger.debug(str(th.before))
-    logger.debug("MATCH: " + str(th.after))
-    sl('yes')
-    
-    ex(['SPK text transfer format'], timeout=dt)
-    logger.debug(str(th.before))
-    logger.debug("MATCH: " + str(th.after))
-    sl('NO')
-    
-    rtn = ex(['SPK object START'], timeout=dt)
-    logger.debug(str(th.before))
-    logger.debug("MATCH: " + str(th.after))
-    sl(startdate)
-    
-    rtn = ex(['SPK object STOP'], timeout=dt)
-    logger.debug(str(th.before))
-    logger.debug("MATCH: " + str(th.after))
-    sl(stopdate)
-    
-    # We're just single-body routine
-    rtn = ex(['Add more objects to file'], timeout=dt)
-    logger.debug(str(th.before))
-    logger.debug("MATCH: " + str(th.after))
-    sl('no')
-
-    rtn = ex(['ftp.*\r\n'], timeout=dt)
-    logger.debug(str(th.before))
-    logger.debug("MATCH: " + str(th.after))
-    # URL has to be stripped out of \r\n charactes and decoded to string
-    FTPURL = th.after.strip().decode('utf-8')
-    logger.info("FTP url: " + FTPURL)
-
-    sl('quit')
+    try:
+        # Wait for Horizons prompt
+        ee('Horizons>', timeout=dt)
+        _log_step(logger, th)
+
+        sl('PAGE')
+        ee('PAGING toggled OFF', timeout=dt)
+        _log_step(logger, th)
+    
+        # Send target body name to Horizons
+        sl(target)
+    
+        # Horizons will ask if you want to proceed with search
+        ee('Continue', timeout=dt)
+        _log_step(logger, th)
+        sl('yes')
+
+        rtn = ee(['[S]PK', 'No matches found'], timeout=dt)
+        _log_step(logger, th)
+        if rtn == 1:
+            logger.error('No match found for %s', target)
+            raise SBSPKError('No match found for ' + target)
+        sl('s')
+
+        # Before email address prompt there's printed object ID
+        ee('Enter your Internet e-mail address', timeout=dt)
+        _log_step(logger, th)
+
+        # Parse th.before to extract object ID
+        m = _OBJID_RE.search(th.before)
+        if m is not None:
+            OBJID = m.group(1).decode('ascii')
+            logger.info("Object ID: %s", OBJID)
+        else:
+            raise SBSPKError('Cannot parse object ID')
+
+        sl(email)
+    
+        ee('Confirm e-mail address', timeout=dt)
+        _log_step(logger, th)
+        sl('yes')
+    
+        ee('SPK text transfer format', timeout=dt)
+        _log_step(logger, th)
+        sl('NO')
+    
+        rtn = ee('SPK object START', timeout=dt)
+        _log_step(logger, th)
+        sl(startdate)
+    
+        rtn = ee('SPK object STOP', timeout=dt)
+        _log_step(logger, th)
+        sl(stopdate)
+    
+        # We're just single-body routine
+        rtn = ee('Add more objects to file', timeout=dt)
+        _log_step(logger, th)
+        sl('no')
+
+        rtn = ex(['ftp.*\r\n'], timeout=dt)
+        _log_step(logger, th)
+        # URL is cut out of the matched line on bytes, then decoded
+        FTPURL = _FTPURL_RE.search(th.after).group(0).decode('ascii')
+        logger.info("FTP url: %s", FTPURL)
+
+        sl('quit')
+    finally:
+        th.close()
     return FTPURL, OBJID
 
 
+def talk_batch(targets, email, startdate, stopdate, timeout):
+    '''
+    "Talks" to the JPL Horizons to generate one SPICE kernel holding many small-bodies.
+    
+    Works like ``sbspk._sbspk.talk``, but all ``targets`` are added to
+    a single SPK file within one telnet session, answering ``yes`` to 
+    the "Add more objects to file" prompt until the list is exhausted.
+    
+    Arguments:
+        targets (list): Names of target objects.
+        email (str): Your email address.
+        startdate (str): Ephemeris start date for an SPK file, for example ``'2010-01-01'``.
+        stoptdate (str): Ephemeris stop date for an SPK file, for example ``'2040-01-01'``.
+        timeout (int): Max time to wait for expected JPL Horizons output, seconds.
+    
+    Raises:
+        socket.timeout: ``timeout`` was reached. Aside of network connectivity
+                         problems may indicate Horizons interface change.
+        sbspk.SBSPKError: Raised if either any of ``targets`` was not found or 
+                          object ID could not be extracted from the telnet output.
+    
+    Returns:
+        FTPURL (str): Full ftp address of a generated binary SPK file for download.
+        OBJIDS (list): Horizons system object IDs, in ``targets`` order.
+    '''
+    logger = logging.getLogger("SBSPK_TalkLogger")
+    th = _TelnetSession('horizons.jpl.nasa.gov', 6775, timeout)
+    ex = th.expect
+    ee = th.expect_exact
+    sl = th.sendline
+    dt = timeout
+    OBJIDS = []
+    
+    try:
+        ee('Horizons>', timeout=dt)
+        _log_step(logger, th)
+
+        sl('PAGE')
+        ee('PAGING toggled OFF', timeout=dt)
+        _log_step(logger, th)
+        
+        for n, target in enumerate(targets):
+            sl(target)
+            
+            ee('Continue', timeout=dt)
+            _log_step(logger, th)
+            sl('yes')
+            
+            # First object goes through the main menu, the following ones
+            # are looked up from within the SPK dialog
+            rtn = ee(['[S]PK', 'No matches found', 'Add more objects to file'], timeout=dt)
+            _log_step(logger, th)
+            if rtn == 1:
+                logger.error('No match found for %s', target)
+                raise SBSPKError('No match found for ' + target)
+            seen = th.before
+            if n == 0:
+                sl('s')
+                ee('Enter your Internet e-mail address', timeout=dt)
+                _log_step(logger, th)
+                seen += th.before
+            
+            m = _OBJID_RE.search(seen)
+            if m is not None:
+                OBJIDS.append(m.group(1).decode('ascii'))
+                logger.info("Object ID: %s", OBJIDS[-1])
+            else:
+                raise SBSPKError('Cannot parse object ID')
+            
+            if n == 0:
+                sl(email)
+                
+                ee('Confirm e-mail address', timeout=dt)
+                _log_step(logger, th)
+                sl('yes')
+                
+                ee('SPK text transfer format', timeout=dt)
+                _log_step(logger, th)
+                sl('NO')
+                
+                ee('SPK object START', timeout=dt)
+                _log_step(logger, th)
+                sl(startdate)
+                
+                ee('SPK object STOP', timeout=dt)
+                _log_step(logger, th)
+                sl(stopdate)
+                
+                ee('Add more objects to file', timeout=dt)
+                _log_step(logger, th)
+            
+            if n == len(targets) - 1:
+                sl('no')
+            else:
+                sl('yes')
+                # Wait for the next object name prompt
+                ex(['[Oo]bject[^\r\n]*:'], timeout=dt)
+                _log_step(logger, th)
+
+        ex(['ftp.*\r\n'], timeout=dt)
+        _log_step(logger, th)
+        FTPURL = _FTPURL_RE.search(th.after).group(0).decode('ascii')
+        logger.info("FTP url: %s", FTPURL)
+
+        sl('quit')
+    finally:
+        th.close()
+    return FTPURL, OBJIDS
+
+
 class SBSPK(object):
     ''' 
     Retrieves a small-body SPICE binary kernel from the JPL Horizons system.
     
     Kernel files are saved to disk. Horizons telnet interface is used.
-    A telnet client has to be installed on your system, as well as your 
-    firewall must allow for a telnet connection to horizons.jpl.nasa.gov
+    Your firewall must allow for a telnet connection to horizons.jpl.nasa.gov
     on a port 6775, and for establishing a passive ftp conection.
     
     This class has a number of user-accesible parameters and a single 
@@ -179,12 +518,15 @@ class SBSPK(object):
     The SBSPK class ``__init__`` method takes ``_talkfunc`` keyword arg
     that defaults to ``sbspk._sbspk.talk`` function. Other functions 
     can be supplied here as a drop-in replacement if they match 
-    ``sbspk._sbspk.talk`` args and returns.
+    ``sbspk._sbspk.talk`` args and returns. Likewise ``_talkbatchfunc``
+    defaults to ``sbspk._sbspk.talk_batch``.
     '''
     
     printprogress = False
     ''' Prints the SPK download progress meter. This is separate from 
-    logging and turned off by default. '''
+    logging and turned off by default. When many targets are downloaded
+    concurrently (``max_workers`` > 1), a line per finished kernel is 
+    printed instead of the meter. '''
     
     email = 'sorry@noemail.org'     #: Email address required by Horizons SPK generation 
     """Email address required by Horizons SPK generation. """
@@ -197,26 +539,62 @@ class SBSPK(object):
     
     timeout = 5
     ''' Max time to wait for an expected JPL Horizons output (seconds).
-    After this a ``pexpect.TIMEOUT`` exception will be thrown. '''
+    After this a ``socket.timeout`` exception will be thrown. '''
+    
+    fileformat = "{OBJID}_{TARGET}.bsp"
+    ''' Kernel file name format. ``{OBJID}`` will be replaced with 
+    a current object ID, ``{TARGET}`` will be replaced with a specified
+    targe name. Old-style ``<OBJID>`` and ``<TARGET>`` are accepted too.
+    Be carefull - files will be overwritten without any warning. '''
+    
+    max_workers = 4
+    ''' Max number of targets retrieved concurrently, each in its own
+    thread with a separate Horizons session. '''
+    
+    batch = False
+    ''' If set, ``SBSPK.get`` called with many targets retrieves them 
+    with ``SBSPK.get_batch`` into a single multi-object kernel file. '''
     
-    fileformat = "<OBJID>_<TARGET>.bsp"
-    ''' Kernel file name format. ``<OBJID>`` will be replaced with 
-    a current object ID, ``<TARGET>`` will be replaced with a specified
-    targe name. Be carefull - files will be overwritten without 
-    any warning. '''
+    batchfilename = "batch.bsp"
+    ''' Kernel file name used by ``SBSPK.get_batch``. Be carefull - the
+    file is overwritten without any warning by every batch retrieval 
+    into the same directory. '''
     
-    def __init__(self, _talkfunc=talk):
+    cache_path = os.path.join(os.path.expanduser('~'), '.cache', 'sbspk', 'cache.json')
+    ''' JSON file remembering object IDs and kernel URLs of already
+    retrieved targets, so that re-runs of ``SBSPK.get`` can skip the
+    Horizons session. Set to ``None`` to disable caching. '''
+    
+    def __init__(self, _talkfunc=talk, _talkbatchfunc=talk_batch):
         self.logger = logging.getLogger("SBSPK_Logger")
         # we assing it here, so its a function, not a bound method
         self._talk_to_horizon_func = _talkfunc
+        self._talk_batch_to_horizon_func = _talkbatchfunc
+        # serializes progress meter writes from worker threads
+        self._stdout_lock = threading.Lock()
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._last_progress_ts = 0
+        # printprogress for the current call, off when downloads overlap
+        self._show_progress = False
+        self._ftp_pool = _FTPPool()
+        # one lock per destination file, see __download
+        self._path_locks = {}
+        self._path_locks_lock = threading.Lock()
     
-    def __print_download_progress(self, count, blockSize, totalSize):
-        if self.printprogress:
-            percent = min(int(count*blockSize*100/totalSize), 100)
-            sys.stdout.write("\rDownloading kernel... %2d%%" % percent)
-            sys.stdout.flush()
+    def __print_download_progress(self, done, totalSize):
+        if self._show_progress and totalSize > 0:
+            percent = min(done*100 // totalSize, 100)
+            # Redraw at most 10 times per second, but always show 100%
+            now = time.monotonic()
+            if now - self._last_progress_ts < 0.1 and percent < 100:
+                return
+            self._last_progress_ts = now
+            with self._stdout_lock:
+                sys.stdout.write("\rDownloading kernel... %2d%%" % percent)
+                sys.stdout.flush()
     
-    def get(self, target, directory='/tmp'):
+    def get(self, target, directory='/tmp', force_refresh=False):
         ''' Generates and downloads ``target``-body binary SPK file.
         
         If Horizons system cannot find a given target object (or its 
@@ -237,35 +615,238 @@ class SBSPK(object):
 
             directory: Directory to which kernel file(s) will be 
                        downloaded to. Defaults to ``'/tmp'``.
+            force_refresh: If set, kernels are always generated anew, 
+                           ignoring ``cache_path`` entries and files
+                           already present in ``directory``.
         Returns: 
-            List of ``[SPK_file, horizons_object_ID]``, (str, str) pairs.
+            List of ``[SPK_file, horizons_object_ID]``, (str, str) pairs,
+            in the same order as ``target``.
         
-        TODO: smarter retrieving
+        Targets already retrieved before, whose kernel files are still 
+        in ``directory``, are returned right away without asking Horizons.
+        Targets are retrieved concurrently, up to ``max_workers`` at once,
+        repeated names are retrieved only once. The ``printprogress`` 
+        meter is shown only when a single download runs at a time, 
+        otherwise each finished kernel is reported with a line.
+        If ``batch`` is set, many targets are retrieved with 
+        ``SBSPK.get_batch`` instead.
         '''
         if isinstance(target, str):
             target = [target]
-            
-        paths_and_objids = []
-        for trgt in target:
-            r = self.__get_one(trgt, directory)
-            paths_and_objids.append(r)
-        return paths_and_objids
+        if self.batch and len(target) > 1:
+            return self.get_batch(target, directory)
+        # A bad fileformat should fail here, not after talking to Horizons
+        try:
+            self.__kernel_filename('target', '0')
+        except (KeyError, IndexError, ValueError) as e:
+            raise SBSPKError('Invalid fileformat %r: %r' % (self.fileformat, e))
         
-    def __get_one(self, target, directory):
+        # Each name is retrieved once, different names that end up in
+        # the same file are serialized in __download
+        unique = list(dict.fromkeys(t.strip() for t in target))
+        self._show_progress = self.printprogress and (
+                len(unique) == 1 or self.max_workers == 1)
+        self._cache = self.__load_cache()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as ex:
+                results = dict(zip(unique, ex.map(
+                        lambda trgt: self.__get_one(trgt, directory, force_refresh), unique)))
+        finally:
+            self._ftp_pool.close()
+            self.__save_cache()
+        return [results[t.strip()] for t in target]
+        
+    def get_batch(self, target, directory='/tmp'):
+        ''' Generates and downloads a single SPK file with all ``target`` bodies.
+        
+        All bodies are added to one kernel within a single Horizons 
+        session, which saves a login and menu round-trip per body. 
+        Repeated names are added only once. The file is named after 
+        ``batchfilename`` and overwrites a previous batch kernel.
+        
+        Parameters:
+            target: List/tuple of Solar System small body names.
+            directory: Directory to which kernel file will be 
+                       downloaded to. Defaults to ``'/tmp'``.
+        Returns: 
+            List of ``[SPK_file, horizons_object_ID]``, (str, str) pairs,
+            in the same order as ``target``. ``SPK_file`` is the same
+            for all of them.
+        
+        An ``sbspk.SBSPKError`` is raised for an empty ``target`` list.
+        '''
+        target = [t.strip() for t in target]
+        if not target:
+            raise SBSPKError('No targets given for a batch kernel')
+        unique = list(dict.fromkeys(target))
+        self._show_progress = self.printprogress
+        self.logger.info("Retrieving %s", ", ".join(unique))
+        try:
+            url, objids = self._talk_batch_to_horizon_func(unique, self.email, 
+                                self.startdate, self.stopdate, self.timeout)
+        except socket.timeout:
+            self.logger.error("TIMED OUT. Perhaps inteface changed?")
+            raise
+        filepath = os.path.join(directory, self.batchfilename)
+        try:
+            self.__download(url, filepath)
+        finally:
+            self._ftp_pool.close()
+        if self._show_progress: 
+            with self._stdout_lock:
+                print('  Done.')
+        self.logger.info('Kernel file can be found at %s', filepath)
+        objids = dict(zip(unique, objids))
+        return [(filepath, objids[t]) for t in target]
+        
+    def __get_one(self, target, directory, force_refresh=False):
         target = target.strip()
-        self.logger.info("Retrieving " + target)
+        key = '|'.join((target, self.startdate, self.stopdate))
+        with self._cache_lock:
+            entry = None if force_refresh else self._cache.get(key)
+        
+        if entry is not None:
+            filepath = os.path.join(directory, self.__kernel_filename(target, entry['objid']))
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                st = None
+            # Only the very file downloaded for this entry will do, the name 
+            # is shared by kernels generated for other start/stop dates
+            if (st is not None and os.path.abspath(filepath) == entry['path']
+                    and st.st_size > 0
+                    and st.st_size == entry['size'] and st.st_mtime == entry['mtime']):
+                self.logger.info('Kernel file for %s already at %s', target, filepath)
+                return filepath, entry['objid']
+            # Horizons keeps generated kernels on ftp for a while only,
+            # the file there must still be the one downloaded before
+            if time.time() - entry['time'] < _URL_REUSE_WINDOW:
+                try:
+                    self.__download(entry['url'], filepath, size=entry['size'])
+                except (error_perm, URLError, SBSPKError):
+                    self.logger.info('Cached kernel URL for %s expired', target)
+                else:
+                    return self.__finish_one(key, filepath, entry['url'], 
+                                             entry['objid'], entry['time'])
+        
+        self.logger.info("Retrieving %s", target)
         try:
             url, objid = self._talk_to_horizon_func(target, self.email, 
                             self.startdate, self.stopdate, self.timeout)
-        except pexpect.TIMEOUT:
+        except socket.timeout:
             self.logger.error("TIMED OUT. Perhaps inteface changed?")
             raise
         else:
-            filename = self.fileformat.replace("<OBJID>", objid).replace("<TARGET>", target.replace(' ', '_'))
-            filepath = os.path.join(directory, filename)
-            urlret = urlretrieve(url, filepath, reporthook=self.__print_download_progress)
-            if self.printprogress: 
+            filepath = os.path.join(directory, self.__kernel_filename(target, objid))
+            self.__download(url, filepath)
+            return self.__finish_one(key, filepath, url, objid)
+    
+    def __finish_one(self, key, filepath, url, objid, retrieved=None):
+        if self._show_progress: 
+            with self._stdout_lock:
                 print('  Done.')
-            self.logger.info('Kernel file can be found at ' + urlret[0])
-            return urlret[0], objid
+        elif self.printprogress:
+            # meter suppressed for overlapping downloads
+            with self._stdout_lock:
+                print('Downloaded kernel ' + filepath)
+        self.logger.info('Kernel file can be found at %s', filepath)
+        st = os.stat(filepath)
+        with self._cache_lock:
+            self._cache[key] = {'objid': objid, 'url': url, 
+                                'path': os.path.abspath(filepath),
+                                'size': st.st_size, 'mtime': st.st_mtime,
+                                # when Horizons generated the kernel
+                                'time': time.time() if retrieved is None else retrieved}
+        return filepath, objid
+    
+    def __kernel_filename(self, target, objid):
+        return _fileformat_template(self.fileformat).format_map(
+                    {'OBJID': objid, 'TARGET': target.replace(' ', '_')})
+    
+    def __load_cache(self):
+        if self.cache_path is None:
+            return {}
+        try:
+            with open(self.cache_path, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(cache, dict):
+            return {}
+        # Drop entries written by older versions or edited by hand
+        fields = ('objid', 'url', 'path', 'size', 'mtime', 'time')
+        return {k: v for k, v in cache.items() 
+                if isinstance(v, dict) and all(f in v for f in fields)}
+    
+    def __save_cache(self):
+        if self.cache_path is None:
+            return
+        try:
+            cachedir = os.path.dirname(self.cache_path)
+            if cachedir:
+                os.makedirs(cachedir, exist_ok=True)
+            tmppath = self.cache_path + '.tmp'
+            with open(tmppath, 'w') as f:
+                json.dump(self._cache, f, indent=1)
+            os.replace(tmppath, self.cache_path)
+        except OSError as e:
+            self.logger.warning('Cannot write cache file: %s', e)
+    
+    def __download(self, url, filepath, size=None):
+        ''' Streams ``url`` to ``filepath`` in ``_CHUNK_SIZE`` pieces. 
+        
+        Horizons ftp:// URLs are retrieved with ``ftplib`` directly,
+        anything else goes through ``urlopen``. Data goes to a unique 
+        temporary file first, so a failed transfer leaves ``filepath`` 
+        untouched. Downloads to the same ``filepath`` run one at a time,
+        the last one wins. If ``size`` is given, a transfer of any other
+        length raises ``sbspk.SBSPKError``.
+        '''
+        with self._path_locks_lock:
+            lock = self._path_locks.setdefault(os.path.abspath(filepath), 
+                                               threading.Lock())
+        with lock:
+            fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(filepath) or '.',
+                                           prefix='.sbspk-', suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb', buffering=_WRITE_BUFFER_SIZE) as f:
+                    if urlsplit(url).scheme == 'ftp':
+                        self.__download_ftp(url, f)
+                    else:
+                        self.__download_url(url, f)
+                    if size is not None and f.tell() != size:
+                        raise SBSPKError('Kernel size mismatch for ' + url)
+                os.chmod(tmppath, 0o666 & ~_UMASK)
+                os.replace(tmppath, filepath)
+            except BaseException:
+                if os.path.exists(tmppath):
+                    os.remove(tmppath)
+                raise
+    
+    def __download_ftp(self, url, f):
+        parts = urlsplit(url)
+        with self._ftp_pool.connection(parts.hostname, self.timeout) as ftp:
+            try:
+                total = ftp.size(parts.path) or -1
+            except ftplib_errors:
+                total = -1
+            done = 0
+            def write(chunk):
+                nonlocal done
+                f.write(chunk)
+                done += len(chunk)
+                self.__print_download_progress(done, total)
+            ftp.retrbinary('RETR ' + parts.path, write, blocksize=_CHUNK_SIZE)
+    
+    def __download_url(self, url, f):
+        with contextlib.closing(urlopen(url, timeout=self.timeout)) as resp:
+            total = int(resp.headers.get('Content-Length') or -1)
+            done = 0
+            while True:
+                chunk = resp.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                done += len(chunk)
+                self.__print_download_progress(done, total)
 
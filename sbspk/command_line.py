@@ -34,7 +34,7 @@ def main():
         targets = p.targets
     elif p.filename is not None:
         with open(p.filename, 'r') as f:
-            targets = [t.strip() for t in f]
+            targets = [t for t in f.read().splitlines() if t.strip()]
     else:
         raise RuntimeError
 
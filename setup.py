@@ -33,7 +33,7 @@ setup(
 
     keywords='astronomy horizons spice kernels',
     packages=find_packages(exclude=['docs', 'tests']),
-    install_requires=['pexpect'],
+    install_requires=[],
 
     entry_points = {
         'console_scripts': ['sbspk=sbspk.command_line:main'],
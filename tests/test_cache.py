@@ -0,0 +1,124 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from sbspk import SBSPK
+
+
+class CachedKernelTest(unittest.TestCase):
+    ''' Kernel cache must not hand out a file generated for other dates. '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.outdir = os.path.join(self.tmpdir, 'out')
+        os.mkdir(self.outdir)
+        # Fake Horizons kernels, one per start date, told apart by size
+        self.kernels = {}
+        for year, size in (('2010', 1000), ('2020', 2000)):
+            path = os.path.join(self.tmpdir, 'kernel' + year)
+            with open(path, 'wb') as f:
+                f.write(year.encode('ascii') * (size // 4))
+            self.kernels[year] = path
+        self.talks = []
+
+        def fake_talk(target, email, startdate, stopdate, timeout):
+            self.talks.append(startdate)
+            return 'file://' + self.kernels[startdate[:4]], '111'
+
+        self.s = SBSPK(_talkfunc=fake_talk)
+        self.s.cache_path = os.path.join(self.tmpdir, 'cache.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get(self, startdate, **kwargs):
+        self.s.startdate = startdate
+        [(path, objid)] = self.s.get('X', directory=self.outdir, **kwargs)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_switching_startdate_returns_matching_kernel(self):
+        self.assertTrue(self.get('2010-01-01').startswith(b'2010'))
+        self.assertTrue(self.get('2020-01-01').startswith(b'2020'))
+        # Same file name as the 2020 kernel, must not be taken from disk
+        self.assertTrue(self.get('2010-01-01').startswith(b'2010'))
+        self.assertEqual(self.talks, ['2010-01-01', '2020-01-01'])
+
+    def test_unchanged_kernel_skips_download(self):
+        self.get('2010-01-01')
+        os.remove(self.kernels['2010'])
+        self.assertTrue(self.get('2010-01-01').startswith(b'2010'))
+        self.assertEqual(self.talks, ['2010-01-01'])
+
+    def test_force_refresh_talks_to_horizons(self):
+        self.get('2010-01-01')
+        self.get('2010-01-01', force_refresh=True)
+        self.assertEqual(self.talks, ['2010-01-01', '2010-01-01'])
+
+    def test_kernel_path_follows_fileformat(self):
+        os.mkdir(os.path.join(self.outdir, 'kernels'))
+        self.s.fileformat = 'kernels/<OBJID>_<TARGET>.bsp'
+        for i in range(2):
+            [(path, objid)] = self.s.get('X', directory=self.outdir)
+            self.assertEqual(path, os.path.join(self.outdir, 'kernels', '111_X.bsp'))
+        self.s.fileformat = '{TARGET}.bsp'
+        [(path, objid)] = self.s.get('X', directory=self.outdir)
+        self.assertEqual(path, os.path.join(self.outdir, 'X.bsp'))
+        self.assertEqual(self.talks, ['2010-01-01'])
+
+    def test_relative_directory_on_cache_hit(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            first = self.s.get('X', directory='out')
+            self.assertEqual(self.s.get('X', directory='out'), first)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(first, [(os.path.join('out', '111_X.bsp'), '111')])
+        self.assertEqual(self.talks, ['2010-01-01'])
+
+    def age_cache(self, seconds):
+        with open(self.s.cache_path) as f:
+            cache = json.load(f)
+        for entry in cache.values():
+            entry['time'] -= seconds
+        with open(self.s.cache_path, 'w') as f:
+            json.dump(cache, f)
+
+    def test_old_cached_url_is_not_reused(self):
+        self.get('2010-01-01')
+        os.remove(os.path.join(self.outdir, '111_X.bsp'))
+        self.age_cache(2*3600)
+        self.get('2010-01-01')
+        self.assertEqual(self.talks, ['2010-01-01', '2010-01-01'])
+
+    def test_replaced_file_at_cached_url_is_rejected(self):
+        self.get('2010-01-01')
+        os.remove(os.path.join(self.outdir, '111_X.bsp'))
+        with open(self.kernels['2010'], 'ab') as f:
+            f.write(b'other')
+        self.get('2010-01-01')
+        self.assertEqual(self.talks, ['2010-01-01', '2010-01-01'])
+
+    def test_local_errors_are_not_taken_for_expired_url(self):
+        self.get('2010-01-01')
+        shutil.rmtree(self.outdir)
+        with self.assertRaises(FileNotFoundError):
+            self.get('2010-01-01')
+        self.assertEqual(self.talks, ['2010-01-01'])
+
+    def test_cache_path_without_directory(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            self.s.cache_path = 'c.json'
+            self.get('2010-01-01')
+            self.assertTrue(os.path.exists('c.json'))
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sbspk import SBSPK, SBSPKError
+
+
+class ConcurrentGetTest(unittest.TestCase):
+    ''' Concurrent workers writing kernels into one directory. '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.kernel = os.path.join(self.tmpdir, 'kernel')
+        with open(self.kernel, 'wb') as f:
+            f.write(b'k' * 100000)
+        self.talks = []
+
+        def fake_talk(target, email, startdate, stopdate, timeout):
+            self.talks.append(target)
+            return 'file://' + self.kernel, '42'
+
+        self.s = SBSPK(_talkfunc=fake_talk)
+        self.s.cache_path = None
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_names_sharing_a_kernel_file(self):
+        # 'A B' and 'A_B' both end up as 42_A_B.bsp
+        r = self.s.get(['A B', 'A_B', 'A B '], directory=self.tmpdir)
+        path = os.path.join(self.tmpdir, '42_A_B.bsp')
+        self.assertEqual(r, [(path, '42')] * 3)
+        self.assertEqual(sorted(self.talks), ['A B', 'A_B'])
+        self.assertEqual(os.path.getsize(path), 100000)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['42_A_B.bsp', 'kernel'])
+
+    def test_batch_repeated_names(self):
+        sent = []
+
+        def fake_talk_batch(targets, email, startdate, stopdate, timeout):
+            sent.append(list(targets))
+            return 'file://' + self.kernel, [str(len(t)) for t in targets]
+
+        s = SBSPK(_talkbatchfunc=fake_talk_batch)
+        r = s.get_batch(['bb', 'a ', 'bb', 'a'], directory=self.tmpdir)
+        path = os.path.join(self.tmpdir, 'batch.bsp')
+        self.assertEqual(sent, [['bb', 'a']])
+        self.assertEqual(r, [(path, '2'), (path, '1'), (path, '2'), (path, '1')])
+
+
+class FileformatTest(unittest.TestCase):
+    ''' Kernel file names built from new, old-style and mixed formats. '''
+
+    def setUp(self):
+        self.talks = []
+
+        def fake_talk(target, email, startdate, stopdate, timeout):
+            self.talks.append(target)
+            raise SBSPKError('not expected to talk')
+
+        self.s = SBSPK(_talkfunc=fake_talk)
+        self.s.cache_path = None
+
+    def filename(self, fileformat):
+        self.s.fileformat = fileformat
+        return self.s._SBSPK__kernel_filename('2000 SG344', '12')
+
+    def test_formats(self):
+        cases = [
+            ('{OBJID}_{TARGET}.bsp', '12_2000_SG344.bsp'),
+            ('<OBJID>_<TARGET>.bsp', '12_2000_SG344.bsp'),
+            ('<OBJID>_{v1}.bsp', '12_{v1}.bsp'),
+            ('{OBJID}_<TARGET>.bsp', '12_2000_SG344.bsp'),
+            ('k{v1}.bsp', 'k{v1}.bsp'),
+        ]
+        for fileformat, name in cases:
+            self.assertEqual(self.filename(fileformat), name)
+
+    def test_bad_format_fails_before_talking(self):
+        for fileformat in ('{OBJID}_{v1}.bsp', '{OBJID}_{TARGET.bsp'):
+            self.s.fileformat = fileformat
+            with self.assertRaises(SBSPKError):
+                self.s.get('X')
+        self.assertEqual(self.talks, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
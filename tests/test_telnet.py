@@ -0,0 +1,200 @@
+import re
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+
+from sbspk import SBSPKError
+from sbspk._sbspk import _TelnetSession, talk, talk_batch
+
+IAC, DONT, DO, WONT, WILL = 255, 254, 253, 252, 251
+
+
+class FakeServer(object):
+    ''' One-connection scripted TCP server standing in for Horizons. '''
+
+    def __init__(self, script):
+        self.srv = socket.socket()
+        self.srv.bind(('127.0.0.1', 0))
+        self.srv.listen(1)
+        self.port = self.srv.getsockname()[1]
+        self.script = script
+        self.received = b''
+        self.error = None
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def __run(self):
+        conn, _ = self.srv.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.conn = conn
+        self._buf = b''
+        try:
+            self.script(self)
+        except Exception as e:
+            self.error = e
+        finally:
+            conn.close()
+            self.srv.close()
+
+    def send(self, data):
+        self.conn.sendall(data)
+
+    def send_pieces(self, *pieces):
+        # Sent apart in time, so the client reads them separately
+        for piece in pieces:
+            self.conn.sendall(piece)
+            time.sleep(0.05)
+
+    def readline(self):
+        while b'\r\n' not in self._buf:
+            data = self.conn.recv(4096)
+            if not data:
+                raise EOFError
+            self.received += data
+            self._buf += data
+        line, self._buf = self._buf.split(b'\r\n', 1)
+        # drop option refusals sent by the client
+        line = re.sub(rb'\xff[\xfb-\xfe].', b'', line, flags=re.DOTALL)
+        return line.decode('utf-8')
+
+    def expect_line(self, expected):
+        line = self.readline()
+        if line != expected:
+            raise AssertionError('got %r, expected %r' % (line, expected))
+
+    def join(self):
+        self.thread.join(5)
+        if self.error is not None:
+            raise self.error
+
+
+def horizons_dialog(targets, objids, url=b'ftp://ssd.jpl.nasa.gov/pub/ssd/wld1234.15'):
+    ''' Horizons SPK dialog as assumed by talk/talk_batch.
+
+    Prompts up to the first "Add more objects to file" come from the real
+    interface. What follows a "yes" answer there (the next object prompt
+    and where its ID is printed) is an assumption of talk_batch.
+    '''
+    def script(srv):
+        srv.send(bytes([IAC, WILL, 1]) + b'Welcome\r\nHorizons> ')
+        srv.expect_line('PAGE')
+        srv.send(b'PAGING toggled OFF\r\nHorizons> ')
+        for n, (target, objid) in enumerate(zip(targets, objids)):
+            srv.expect_line(target)
+            srv.send(b'Searching...\r\n Continue [ <cr>=yes, n=no, ? ] : ')
+            srv.expect_line('yes')
+            if objid is None:
+                srv.send(b'No matches found.\r\nHorizons> ')
+                return
+            record = (' Rec #: 1  %s   object ID: %s\r\n' % (target, objid)).encode()
+            if n == 0:
+                srv.send(b'Select ... [E]phemeris, [F]tp, [M]ail, [R]edisplay, [S]PK,?, <cr>: ')
+                srv.expect_line('s')
+                srv.send(record + b' Enter your Internet e-mail address [?]: ')
+                srv.expect_line('me@example.org')
+                srv.send(b' Confirm e-mail address [?]: ')
+                srv.expect_line('yes')
+                srv.send(b' SPK text transfer format  [ YES, NO, ? ] : ')
+                srv.expect_line('NO')
+                srv.send(b' SPK object START [ t >= 1900-Jan-01, ? ] : ')
+                srv.expect_line('2010-01-01')
+                srv.send(b' SPK object STOP  [ t <= 2100-Jan-01, ? ] : ')
+                srv.expect_line('2040-01-01')
+            else:
+                srv.send(record)
+            srv.send(b' Add more objects to file  [ YES, NO, ? ] : ')
+            if n == len(targets) - 1:
+                srv.expect_line('no')
+            else:
+                srv.expect_line('yes')
+                srv.send(b' Enter next object name  [ ? ] : ')
+        srv.send(b' File : ' + url + b'\r\n\r\n Select ... : ')
+        srv.expect_line('quit')
+    return script
+
+
+class TelnetTest(unittest.TestCase):
+
+    def connect(self, script):
+        self.server = FakeServer(script)
+        create_connection = socket.create_connection
+        port = self.server.port
+
+        def fake_create_connection(address, timeout=None):
+            self.assertEqual(address, ('horizons.jpl.nasa.gov', 6775))
+            return create_connection(('127.0.0.1', port), timeout)
+
+        patcher = mock.patch('sbspk._sbspk.socket.create_connection',
+                             fake_create_connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_telnet_commands_split_across_reads(self):
+        def script(srv):
+            srv.send_pieces(b'abc' + bytes([IAC]), bytes([DO]), bytes([24]) + b'de',
+                            bytes([IAC, IAC]) + b'f' + bytes([IAC, WILL]),
+                            bytes([1]) + b'Horizons> ')
+            srv.expect_line('ok')
+        self.connect(script)
+        th = _TelnetSession('horizons.jpl.nasa.gov', 6775, 2)
+        self.assertEqual(th.expect_exact('Horizons>', 2), 0)
+        self.assertEqual(th.before, b'abcde\xfff')
+        th.sendline('ok')
+        th.close()
+        self.server.join()
+        self.assertIn(bytes([IAC, WONT, 24]), self.server.received)
+        self.assertIn(bytes([IAC, DONT, 1]), self.server.received)
+
+    def test_expect_exact_prompt_split_across_reads(self):
+        def script(srv):
+            srv.send_pieces(b'xx No ma', b'tches f', b'ound [S]', b'PK')
+        self.connect(script)
+        th = _TelnetSession('horizons.jpl.nasa.gov', 6775, 2)
+        self.assertEqual(th.expect_exact(['[S]PK', 'No matches found'], 2), 1)
+        self.assertEqual((th.before, th.after), (b'xx ', b'No matches found'))
+        self.assertEqual(th.expect_exact(['[S]PK', 'No matches found'], 2), 0)
+        self.assertEqual(th.before, b' ')
+        th.close()
+        self.server.join()
+
+    def test_expect_regex_and_timeout(self):
+        def script(srv):
+            srv.send_pieces(b'File : ftp://host/', b'k.15\r\nrest')
+            srv.expect_line('bye')
+        self.connect(script)
+        th = _TelnetSession('horizons.jpl.nasa.gov', 6775, 2)
+        self.assertEqual(th.expect(['nothing', 'ftp.*\r\n'], 2), 1)
+        self.assertEqual(th.after, b'ftp://host/k.15\r\n')
+        with self.assertRaises(socket.timeout):
+            th.expect('nothing', 0.2)
+        th.sendline('bye')
+        th.close()
+        self.server.join()
+
+    def test_talk(self):
+        self.connect(horizons_dialog(['2000 SG344'], ['3054374']))
+        url, objid = talk('2000 SG344', 'me@example.org', '2010-01-01', '2040-01-01', 2)
+        self.server.join()
+        self.assertEqual(url, 'ftp://ssd.jpl.nasa.gov/pub/ssd/wld1234.15')
+        self.assertEqual(objid, '3054374')
+
+    def test_talk_no_match(self):
+        self.connect(horizons_dialog(['nonsense'], [None]))
+        with self.assertRaises(SBSPKError):
+            talk('nonsense', 'me@example.org', '2010-01-01', '2040-01-01', 2)
+        self.server.join()
+
+    def test_talk_batch(self):
+        targets = ['2000 SG344', '2014 SU1', '2015 TB']
+        objids = ['3054374', '3689273', '3728897']
+        self.connect(horizons_dialog(targets, objids))
+        url, found = talk_batch(targets, 'me@example.org', '2010-01-01', '2040-01-01', 2)
+        self.server.join()
+        self.assertEqual(url, 'ftp://ssd.jpl.nasa.gov/pub/ssd/wld1234.15')
+        self.assertEqual(found, objids)
+
+
+if __name__ == '__main__':
+    unittest.main()